@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Group Manager Bot internals
+Usage: python benchmarks.py <benchmark> [options]
+"""
+
+import argparse
+import asyncio
+import difflib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import cbot
+from cbot import Config
+
+# ==================================================
+# HELPERS
+# ==================================================
+
+def report(label: str, ops: int, elapsed: float):
+    """Print a single benchmark result line"""
+    per_op = elapsed / ops * 1e6 if ops else 0.0
+    print(f"  {label:<32} {ops:>8} ops  {elapsed:8.3f}s  {per_op:10.1f} us/op")
+
+async def timed_ops(label: str, func, max_ops: int, budget: float):
+    """Run an async operation up to max_ops times or until the time budget runs out"""
+    ops = 0
+    start = time.perf_counter()
+    while ops < max_ops and time.perf_counter() - start < budget:
+        await func(ops)
+        ops += 1
+    report(label, ops, time.perf_counter() - start)
+
+# ==================================================
+# STORAGE
+# ==================================================
+
+def populate_json(records: int, chats: int):
+    """Write legacy JSON files holding the given number of records"""
+    warnings = {}
+    restrictions = {}
+    until = (datetime.now() + timedelta(days=1)).isoformat()
+    for i in range(records):
+        chat_key = str(-100 - i % chats)
+        user_key = str(i // 2)
+        warnings.setdefault(chat_key, {}).setdefault(user_key, []).append(
+            {"reason": "benchmark", "warned_by": 1, "timestamp": until}
+        )
+        restrictions.setdefault(chat_key, {})[str(i)] = {"until_date": until, "reason": "benchmark", "timestamp": until}
+    
+    os.makedirs("data", exist_ok=True)
+    with open(Config.USER_WARNINGS_FILE, 'w') as f:
+        json.dump(warnings, f)
+    with open(Config.TEMP_BANS_FILE, 'w') as f:
+        json.dump(restrictions, f)
+
+async def bench_backend(backend: cbot.StorageBackend, records: int, chats: int, ops: int, budget: float):
+    """Time the storage operations the bot issues from its handlers"""
+    start = time.perf_counter()
+    await backend.start()
+    report("start (load/migrate)", 1, time.perf_counter() - start)
+    
+    warning = {"reason": "benchmark", "warned_by": 1, "timestamp": datetime.now().isoformat()}
+    record = {"until_date": (datetime.now() + timedelta(hours=1)).isoformat(), "reason": "benchmark",
+              "timestamp": datetime.now().isoformat()}
+    
+    def target(i):
+        index = random.randrange(records)
+        return -100 - index % chats, index // 2
+    
+    async def add_warning(i):
+        await backend.add_warning(*target(i), warning)
+    
+    async def get_warnings(i):
+        await backend.get_warnings(*target(i))
+    
+    async def pop_warning(i):
+        await backend.pop_warning(*target(i))
+    
+    async def save_restriction(i):
+        await backend.save_restriction(-100 - i % chats, records + i, "ban", record)
+    
+    async def remove_restriction(i):
+        await backend.remove_restriction(-100 - i % chats, records + i, "ban")
+    
+    await timed_ops("add_warning", add_warning, ops, budget)
+    await timed_ops("get_warnings", get_warnings, ops, budget)
+    await timed_ops("pop_warning", pop_warning, ops, budget)
+    await timed_ops("save_restriction", save_restriction, ops, budget)
+    await timed_ops("remove_restriction", remove_restriction, ops, budget)
+    
+    start = time.perf_counter()
+    await backend.close()
+    report("close (flush)", 1, time.perf_counter() - start)
+
+async def bench_storage(args):
+    """Compare the JSON and SQLite storage backends at several data sizes"""
+    for records in args.sizes:
+        for name in cbot.STORAGE_BACKENDS:
+            with tempfile.TemporaryDirectory() as workdir:
+                os.chdir(workdir)
+                populate_json(records, args.chats)
+                print(f"{name} backend, {records} records:")
+                await bench_backend(cbot.create_storage(name), records, args.chats, args.ops, args.budget)
+
+# ==================================================
+# BANNED WORDS
+# ==================================================
+
+def legacy_contains_banned_words(banned_words: set, text: str) -> bool:
+    """The per-word substring loop ContentFilter used before the automaton"""
+    text_lower = text.lower()
+    for word in banned_words:
+        if word in text_lower:
+            return True
+    return False
+
+def random_word(rng: random.Random, alphabet: str = "abcdefghijklmnopqrstuvwxyz") -> str:
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(6, 12)))
+
+def inject_word(rng: random.Random, text: str, word: str) -> str:
+    """Insert a word into text with random casing and surrounding punctuation"""
+    variant = rng.choice((word, word.upper(), word.capitalize()))
+    variant = rng.choice(("{}", "{}!", "({})", "{},", '"{}"', "#{}...")).format(variant)
+    tokens = text.split(' ')
+    tokens.insert(rng.randint(0, len(tokens)), variant)
+    return ' '.join(tokens)
+
+def bench_banned_words(args):
+    """Compare the legacy banned-word loop with the Aho-Corasick matcher"""
+    rng = random.Random(42)
+    failed = False
+    
+    for size in args.sizes:
+        words = {random_word(rng) for _ in range(size)}
+        word_list = sorted(words)
+        messages = []
+        injected = 0
+        for _ in range(args.messages):
+            text = ' '.join(random_word(rng) for _ in range(rng.randint(5, 40))).capitalize()
+            if rng.random() < args.match_ratio:
+                text = inject_word(rng, text, rng.choice(word_list))
+                injected += 1
+            messages.append(text)
+        print(f"{len(words)} banned words, {len(messages)} messages ({injected} with a banned word):")
+        
+        start = time.perf_counter()
+        matcher = cbot.BannedWordMatcher(words)
+        report("build automaton", 1, time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        legacy_hits = sum(legacy_contains_banned_words(words, text) for text in messages)
+        report("legacy loop", len(messages), time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        hits = sum(matcher.search(text.lower()) is not None for text in messages)
+        report("automaton search", len(messages), time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        matches = sum(len(matcher.find_all(text.lower())) for text in messages)
+        report("automaton find_all", len(messages), time.perf_counter() - start)
+        
+        if hits != legacy_hits:
+            print(f"  MISMATCH: legacy matched {legacy_hits} messages, automaton {hits}")
+            failed = True
+        if not hits or hits < injected:
+            print(f"  MISSED: {injected} messages contain a banned word, automaton matched {hits}")
+            failed = True
+        print(f"  {hits} messages matched, {matches} total matches")
+    
+    return 1 if failed else 0
+
+# ==================================================
+# TEXT FEATURES
+# ==================================================
+
+def legacy_text_checks(text: str) -> tuple:
+    """The multi-pass spam pattern and link counting code used before TextFeatures"""
+    reasons = []
+    confidence = 0.0
+    
+    caps_ratio = sum(1 for c in text if c.isupper()) / len(text) if text else 0
+    if caps_ratio > 0.5 and len(text) > 10:
+        reasons.append("excessive_caps")
+        confidence += 0.3
+    
+    emoji_count = len([c for c in text if ord(c) > 127])
+    if emoji_count > len(text) * 0.3:
+        reasons.append("excessive_emojis")
+        confidence += 0.2
+    
+    if re.search(r'(.)\1{4,}', text):
+        reasons.append("repetitive_chars")
+        confidence += 0.2
+    
+    for phrase in ["click here", "free money", "earn money", "join now", "limited time"]:
+        if phrase.lower() in text.lower():
+            reasons.append("spam_phrase")
+            confidence += 0.4
+            break
+    
+    link_count = 0
+    if any(x in text.lower() for x in ['http', 'www.', 't.me']):
+        link_patterns = [r'http[s]?://', r'www\.', r't\.me/', r'@\w+']
+        link_count = sum(len(re.findall(pattern, text, re.IGNORECASE)) for pattern in link_patterns)
+    
+    return reasons, link_count
+
+def bench_text_features(args):
+    """Compare per-message CPU cost of the legacy checks and the shared feature extractor"""
+    rng = random.Random(7)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJ0123456789éü😀🔥"
+    extras = [
+        "", " click here", " https://example.com", " www.spam.io t.me/channel @someone", " FREE MONEY!!!!!",
+        " thanks @alice @bob @carol", " mail me at me@gmail.com or @bob @carol", " http @alice @bob @carol",
+    ]
+    messages = [
+        ' '.join(random_word(rng, alphabet) for _ in range(rng.randint(2, args.max_words))) + rng.choice(extras)
+        for _ in range(args.messages)
+    ]
+    content_filter = cbot.ContentFilter()
+    
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        for text in messages:
+            legacy_text_checks(text)
+        report("legacy multi-pass checks", len(messages), time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        for text in messages:
+            features = cbot.TextFeatures(text)
+            content_filter.check_spam_patterns(text, features)
+            features.link_spam_count
+        report("shared feature extraction", len(messages), time.perf_counter() - start)
+    
+    mismatches = 0
+    for text in messages:
+        reasons, link_count = legacy_text_checks(text)
+        features = cbot.TextFeatures(text)
+        if reasons != content_filter.check_spam_patterns(text, features)["reasons"] or link_count != features.link_spam_count:
+            mismatches += 1
+    print(f"  {mismatches} of {len(messages)} messages classified differently")
+    
+    # Mentions alone never count as links, however many there are
+    for text in ("thanks @alice @bob @carol", "mail me at me@gmail.com or @bob @carol"):
+        if cbot.TextFeatures(text).link_spam_count:
+            print(f"  MISMATCH: mention-only message counted as links: {text!r}")
+            mismatches += 1
+    
+    return 1 if mismatches else 0
+
+# ==================================================
+# NEAR-DUPLICATES
+# ==================================================
+
+def legacy_similarity_check(history: dict, user_id: int, text: str) -> bool:
+    """The per-user pairwise difflib check used before the MinHash index"""
+    messages = history.setdefault(user_id, [])
+    messages.append(text)
+    del messages[:-5]
+    
+    if len(messages) >= 3:
+        recent = messages[-3:]
+        for i, first in enumerate(recent[:-1]):
+            for second in recent[i + 1:]:
+                if difflib.SequenceMatcher(None, first, second).ratio() > Config.SIMILAR_MESSAGE_THRESHOLD:
+                    return True
+    return False
+
+def bench_near_duplicates(args):
+    """Compare per-message cost and recall of pairwise difflib and the LSH index"""
+    rng = random.Random(11)
+    templates = [
+        ' '.join(random_word(rng) for _ in range(rng.randint(5, args.max_words)))
+        for _ in range(args.templates)
+    ]
+    messages = []
+    for i in range(args.messages):
+        user_id = rng.randrange(args.users)
+        if rng.random() < args.spam_ratio:
+            # Spam campaign: a template with a small edit, posted by random accounts
+            text = rng.choice(templates) + ' ' + random_word(rng)
+        else:
+            text = ' '.join(random_word(rng) for _ in range(rng.randint(2, args.max_words)))
+        messages.append((user_id, text))
+    
+    history = {}
+    start = time.perf_counter()
+    legacy_hits = sum(legacy_similarity_check(history, user_id, text) for user_id, text in messages)
+    report("pairwise difflib (per user)", len(messages), time.perf_counter() - start)
+    
+    index = cbot.NearDuplicateIndex(
+        Config.SIMILAR_MESSAGE_WINDOW, Config.SIMILAR_MESSAGE_THRESHOLD,
+        Config.SIMILAR_INDEX_CHAT_SIZE, Config.SIMILAR_INDEX_CHATS
+    )
+    start = time.perf_counter()
+    index_hits = 0
+    for user_id, text in messages:
+        match = index.observe(-100, user_id, text)
+        if match["repeats"] >= Config.SIMILAR_MESSAGE_REPEATS or match["users"] >= Config.SIMILAR_MESSAGE_USERS:
+            index_hits += 1
+    report("MinHash LSH index (per chat)", len(messages), time.perf_counter() - start)
+    
+    print(f"  flagged: difflib {legacy_hits}, index {index_hits} "
+          f"({index.candidates / len(messages):.1f} candidates per message)")
+
+# ==================================================
+# MAIN
+# ==================================================
+
+def main():
+    """Parse arguments and run the selected benchmark"""
+    parser = argparse.ArgumentParser(description="Group Manager Bot benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    
+    storage_parser = subparsers.add_parser("storage", help="JSON vs SQLite storage backends")
+    storage_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    storage_parser.add_argument("--chats", type=int, default=100)
+    storage_parser.add_argument("--ops", type=int, default=1000)
+    storage_parser.add_argument("--budget", type=float, default=10.0, help="seconds per operation type")
+    storage_parser.set_defaults(func=bench_storage)
+    
+    words_parser = subparsers.add_parser("banned-words", help="Banned-word loop vs Aho-Corasick matcher")
+    words_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    words_parser.add_argument("--messages", type=int, default=2000)
+    words_parser.add_argument("--match-ratio", type=float, default=0.1, help="share of messages given a banned word")
+    words_parser.set_defaults(func=bench_banned_words)
+    
+    features_parser = subparsers.add_parser("text-features", help="Multi-pass spam checks vs shared feature extraction")
+    features_parser.add_argument("--messages", type=int, default=20_000)
+    features_parser.add_argument("--max-words", type=int, default=40)
+    features_parser.add_argument("--rounds", type=int, default=3)
+    features_parser.set_defaults(func=bench_text_features)
+    
+    duplicates_parser = subparsers.add_parser("near-duplicates", help="Pairwise difflib vs MinHash LSH index")
+    duplicates_parser.add_argument("--messages", type=int, default=20_000)
+    duplicates_parser.add_argument("--users", type=int, default=2000)
+    duplicates_parser.add_argument("--templates", type=int, default=20)
+    duplicates_parser.add_argument("--spam-ratio", type=float, default=0.1)
+    duplicates_parser.add_argument("--max-words", type=int, default=40)
+    duplicates_parser.set_defaults(func=bench_near_duplicates)
+    
+    args = parser.parse_args()
+    cwd = os.getcwd()
+    try:
+        result = args.func(args)
+        if asyncio.iscoroutine(result):
+            result = asyncio.run(result)
+        return result
+    finally:
+        os.chdir(cwd)
+
+if __name__ == "__main__":
+    sys.exit(main())
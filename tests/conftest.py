@@ -0,0 +1,28 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# cbot creates logs/ relative to the working directory on import
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="cbot-tests-"))
+
+
+@pytest.fixture
+def bot():
+    """A bot that is built but never connected; pyrogram's Client wants a current event loop"""
+    import cbot
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        bot = cbot.GroupManagerBot()
+        # Let the client finish registering handlers, which it does in tasks on the loop
+        loop.run_until_complete(asyncio.sleep(0))
+        yield bot
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
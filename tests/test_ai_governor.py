@@ -0,0 +1,75 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import cbot
+
+SPAM = "FREE MONEY!!! CLICK NOW!!! LIMITED OFFER!!! 💰💰💰💰💰💰"
+
+
+class HangingCompletions:
+    """Completion stub whose requests never finish"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.Event().wait()
+    
+    async def close(self):
+        pass
+
+
+def open_breaker(governor, opened_at):
+    governor.state = governor.OPEN
+    governor._opened_at = opened_at
+
+
+def test_open_breaker_never_deletes_or_fingerprints(bot):
+    deleted = []
+    
+    async def delete():
+        deleted.append(True)
+    
+    message = SimpleNamespace(chat=SimpleNamespace(id=-1), from_user=SimpleNamespace(id=7), text=SPAM, delete=delete)
+    
+    async def scenario():
+        completions = HangingCompletions()
+        bot.ai_analyzer.openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        open_breaker(bot.ai_analyzer.governor, time.monotonic())
+        
+        analysis = await bot.ai_analyzer.analyze_message_content(SPAM, -1)
+        moderated = await bot.moderate(None, message, background=True, names={"ai_spam"})
+        return analysis, moderated, completions
+    
+    analysis, moderated, completions = asyncio.run(scenario())
+    assert analysis["fallback"] and analysis["spam_score"] == 0.0
+    assert not moderated and not deleted
+    assert completions.calls == 0
+    assert len(bot.spam_index) == 0
+
+
+def test_cancelled_probe_lets_the_next_one_through(monkeypatch):
+    monkeypatch.setattr(cbot.Config, "AI_BATCH_WINDOW", 0.01)
+    
+    async def scenario():
+        analyzer = cbot.AIAnalyzer()
+        completions = HangingCompletions()
+        analyzer.openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions), close=completions.close)
+        governor = analyzer.governor
+        open_breaker(governor, time.monotonic() - cbot.Config.AI_BREAKER_COOLDOWN - 1)
+        
+        analysis = asyncio.create_task(analyzer.analyze_message_content("is this spam?", -1))
+        while not completions.calls:
+            await asyncio.sleep(0.01)
+        assert governor.state == governor.HALF_OPEN and not governor.allow_request()
+        
+        # Shutting down cancels the probe batch mid-request
+        await analyzer.close()
+        return await analysis, governor
+    
+    analysis, governor = asyncio.run(scenario())
+    assert analysis["fallback"]
+    assert governor.state == governor.HALF_OPEN
+    assert governor.allow_request()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import random
+import threading
+
+import cbot
+
+
+def naive_matches(words, text):
+    return sorted(
+        (word, start, start + len(word))
+        for word in set(words) if word
+        for start in range(len(text) - len(word) + 1)
+        if text.startswith(word, start)
+    )
+
+
+def test_overlapping_words_are_all_reported():
+    matcher = cbot.BannedWordMatcher(["he", "she", "his", "hers"])
+    assert sorted(matcher.find_all("ushers")) == [("he", 2, 4), ("hers", 2, 6), ("she", 1, 4)]
+
+
+def test_search_returns_first_match_to_end():
+    matcher = cbot.BannedWordMatcher(["casino", "sin"])
+    assert matcher.search("best casino ever") == ("sin", 7, 10)
+    assert matcher.search("nothing here") is None
+
+
+def test_empty_matcher_matches_nothing():
+    matcher = cbot.BannedWordMatcher(["", ""])
+    assert len(matcher) == 0
+    assert matcher.find_all("anything") == []
+
+
+def test_matches_agree_with_naive_search():
+    rng = random.Random(3)
+    alphabet = "abc"
+    for _ in range(200):
+        words = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = "".join(rng.choice(alphabet + " ") for _ in range(rng.randint(0, 30)))
+        assert sorted(cbot.BannedWordMatcher(words).find_all(text)) == naive_matches(words, text)
+
+
+def test_content_filter_ignores_case_and_punctuation(tmp_path, monkeypatch):
+    words_file = tmp_path / "banned_words.txt"
+    words_file.write_text("casino\nFree Money\n")
+    monkeypatch.setattr(cbot.Config, "BANNED_WORDS_FILE", str(words_file))
+    monkeypatch.setattr(cbot.Config, "CHAT_BANNED_WORDS_DIR", str(tmp_path / "chats"))
+    
+    content_filter = cbot.ContentFilter()
+    assert content_filter.contains_banned_words("Visit our CASINO!")
+    assert content_filter.contains_banned_words("(free money), today")
+    assert not content_filter.contains_banned_words("a casual message")
+
+
+def test_chat_word_updates_apply_immediately(tmp_path, monkeypatch):
+    monkeypatch.setattr(cbot.Config, "BANNED_WORDS_FILE", str(tmp_path / "banned_words.txt"))
+    monkeypatch.setattr(cbot.Config, "CHAT_BANNED_WORDS_DIR", str(tmp_path / "chats"))
+    # Every write looks unchanged to reload(), as with a coarse filesystem clock
+    monkeypatch.setattr(cbot.ContentFilter, "_mtime", staticmethod(lambda path: 1.0))
+    
+    async def scenario():
+        content_filter = cbot.ContentFilter()
+        await content_filter.update_chat_words(-1, add=["alpha"])
+        await content_filter.update_chat_words(-1, add=["Beta"])
+        await content_filter.update_chat_words(-1, remove=["alpha"])
+        await content_filter.reload()
+        return content_filter
+    
+    content_filter = asyncio.run(scenario())
+    assert content_filter.get_chat_words(-1) == ["beta"]
+    assert content_filter.contains_banned_words("so BETA", chat_id=-1)
+    assert not content_filter.contains_banned_words("alpha", chat_id=-1)
+    assert (tmp_path / "chats" / "-1.txt").read_text() == "beta"
+
+
+def test_reload_never_swaps_back_a_list_updated_during_its_scan(tmp_path, monkeypatch):
+    monkeypatch.setattr(cbot.Config, "BANNED_WORDS_FILE", str(tmp_path / "banned_words.txt"))
+    monkeypatch.setattr(cbot.Config, "CHAT_BANNED_WORDS_DIR", str(tmp_path / "chats"))
+    
+    async def scenario():
+        content_filter = cbot.ContentFilter()
+        await content_filter.update_chat_words(-1, add=["alpha"])
+        # An outside edit gives reload() a changed file to read
+        words_file = tmp_path / "chats" / "-1.txt"
+        words_file.write_text("alpha\nbeta")
+        os.utime(words_file, (1, 1))
+        
+        # Hold the scan after it has read the file until /addword has gone through
+        scanned, release = threading.Event(), threading.Event()
+        scan_changes = content_filter._scan_changes
+        
+        def held_scan(known):
+            rebuilt = scan_changes(known)
+            scanned.set()
+            release.wait(5)
+            return rebuilt
+        
+        content_filter._scan_changes = held_scan
+        reload = asyncio.create_task(content_filter.reload())
+        await asyncio.to_thread(scanned.wait, 5)
+        await content_filter.update_chat_words(-1, add=["gamma"])
+        release.set()
+        await reload
+        return content_filter
+    
+    content_filter = asyncio.run(scenario())
+    assert content_filter.get_chat_words(-1) == ["alpha", "gamma"]
+    assert content_filter.contains_banned_words("gamma", chat_id=-1)
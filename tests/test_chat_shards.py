@@ -0,0 +1,43 @@
+import asyncio
+
+import cbot
+
+
+def test_updates_from_one_chat_run_in_order_across_priorities():
+    async def scenario():
+        shards = cbot.ChatShards(workers=4, max_depth=1000, low_max_depth=1000)
+        seen = {chat_id: [] for chat_id in range(10)}
+        
+        async def job(chat_id, index):
+            await asyncio.sleep(0)
+            seen[chat_id].append(index)
+        
+        for index in range(50):
+            for chat_id in seen:
+                priority = shards.PRIORITY_LOW if index % 7 == 0 else shards.PRIORITY_NORMAL
+                assert shards.submit(chat_id, priority, job, chat_id, index)
+        
+        await shards.start()
+        while sum(shards.depths()):
+            await asyncio.sleep(0.01)
+        await shards.close()
+        return seen
+    
+    for order in asyncio.run(scenario()).values():
+        assert order == list(range(50))
+
+
+def test_behind_shard_sheds_low_priority_and_hands_back_normal_updates():
+    async def noop():
+        pass
+    
+    async def scenario():
+        shards = cbot.ChatShards(workers=1, max_depth=5, low_max_depth=2)
+        accepted = [shards.submit(1, shards.PRIORITY_NORMAL, noop) for _ in range(2)]
+        accepted.append(shards.submit(1, shards.PRIORITY_LOW, noop))
+        accepted += [shards.submit(1, shards.PRIORITY_NORMAL, noop) for _ in range(4)]
+        return shards, accepted
+    
+    shards, accepted = asyncio.run(scenario())
+    assert accepted == [True, True, False, True, True, True, False]
+    assert (shards.dropped, shards.overflowed) == (1, 1)
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+import cbot
+
+CAMPAIGN = "Join our exclusive crypto signals group for guaranteed daily profits"
+
+
+def test_inline_stages_run_known_spam_right_after_flood(bot):
+    inline = [stage.name for stage in bot.pipeline.stages if not stage.background]
+    assert inline[:2] == ["flood", "known_spam"]
+    assert set(inline[2:]) == {"banned_words", "spam_patterns", "link_spam"}
+    assert [stage.name for stage in bot.pipeline.stages if stage.background] == ["similarity", "ai_spam"]
+
+
+def test_cancelled_similarity_check_still_indexes_the_message(bot):
+    async def flag(client, message, fields):
+        return "flagged"
+    
+    async def scenario():
+        pipeline = cbot.ModerationPipeline({"user": lambda m: m.from_user, "text": lambda m: m.text})
+        pipeline.add(cbot.ModerationStage("cached_verdict", flag, 1, ("text",), background=True))
+        pipeline.add(cbot.ModerationStage("similarity", bot.check_similar_messages, 200, ("user", "text"),
+                                          background=True))
+        message = SimpleNamespace(chat=SimpleNamespace(id=-1), from_user=SimpleNamespace(id=7), text=CAMPAIGN)
+        
+        stage, _, _ = await pipeline.run(None, message, background=True, deadline=5)
+        # The similarity stage was cancelled while it waited on the signature batcher
+        await asyncio.sleep(cbot.Config.CPU_BATCH_WINDOW + 0.1)
+        return stage, pipeline
+    
+    stage, pipeline = asyncio.run(scenario())
+    assert stage.name == "cached_verdict"
+    assert pipeline.stages[1].cancelled == 1
+    assert bot.duplicate_index.observe(-1, 8, CAMPAIGN)["users"] == 2
+
+
+def registered_handler(bot, name):
+    for handlers in bot.app.dispatcher.groups.values():
+        for handler in handlers:
+            if handler.callback.__name__ == name:
+                return handler.callback
+    raise LookupError(name)
+
+
+def test_purge_commands_run_off_the_update_worker(bot, monkeypatch):
+    started = []
+    
+    async def slow_is_admin(client, chat_id, user_id):
+        started.append(chat_id)
+        await asyncio.Event().wait()
+    
+    monkeypatch.setattr(cbot, "is_admin", slow_is_admin)
+    message = SimpleNamespace(chat=SimpleNamespace(id=-1), from_user=SimpleNamespace(id=7))
+    # Callback queries carry the chat on their message
+    message.message = message
+    names = ("purge_messages", "purge_user_messages", "raid_cleanup", "handle_report_actions")
+    
+    async def scenario():
+        for name in names:
+            # Returns at once even though the handler itself is still waiting
+            await asyncio.wait_for(registered_handler(bot, name)(None, message), 1)
+        await asyncio.sleep(0)
+        running = len(bot._detached_tasks)
+        await bot.close_detached()
+        return running
+    
+    assert asyncio.run(scenario()) == len(names)
+    assert len(started) == len(names)
+    assert not bot._detached_tasks
@@ -0,0 +1,69 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import cbot
+
+
+class FakeCompletions:
+    """Completion stub that answers every message as clean after a short delay"""
+    
+    def __init__(self):
+        self.batch_sizes = []
+    
+    async def create(self, messages, **kwargs):
+        count = messages[-1]["content"].count("<message index=")
+        self.batch_sizes.append(count)
+        await asyncio.sleep(0.05)
+        results = [{"index": index, "spam_score": 0.0, "toxicity_score": 0.0, "is_appropriate": True}
+                   for index in range(count)]
+        message = SimpleNamespace(content=json.dumps({"results": results}))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def test_queued_checks_fill_ai_batches(monkeypatch):
+    monkeypatch.setattr(cbot.Config, "AI_BATCH_WINDOW", 0.05)
+    count = cbot.Config.AI_BATCH_SIZE + 5
+    
+    async def scenario():
+        analyzer = cbot.AIAnalyzer()
+        completions = FakeCompletions()
+        analyzer.openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        queue = cbot.ModerationQueue(cbot.Config.MODERATION_CONCURRENCY, 1000, 30)
+        verdicts = []
+        
+        async def job(index):
+            verdicts.append(await analyzer.analyze_message_content(f"message number {index}", -100))
+        
+        for index in range(count):
+            assert queue.submit(queue.PRIORITY_NORMAL, "ai", job, index)
+        await queue.start()
+        while len(verdicts) < count:
+            await asyncio.sleep(0.01)
+        await queue.close()
+        return completions.batch_sizes, verdicts, queue
+    
+    batch_sizes, verdicts, queue = asyncio.run(scenario())
+    assert batch_sizes == [cbot.Config.AI_BATCH_SIZE, 5]
+    assert all(not verdict.get("fallback") for verdict in verdicts)
+    assert queue.processed == count and queue.dropped_stale == 0
+
+
+def test_checks_leave_the_queue_in_priority_order():
+    async def scenario():
+        queue = cbot.ModerationQueue(1, 1000, 30)
+        order = []
+        
+        async def job(name):
+            order.append(name)
+        
+        queue.submit(queue.PRIORITY_LOW, "test", job, "low")
+        queue.submit(queue.PRIORITY_NORMAL, "test", job, "normal")
+        queue.submit(queue.PRIORITY_HIGH, "test", job, "high")
+        await queue.start()
+        while len(order) < 3:
+            await asyncio.sleep(0.01)
+        await queue.close()
+        return order
+    
+    assert asyncio.run(scenario()) == ["high", "normal", "low"]
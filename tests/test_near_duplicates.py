@@ -0,0 +1,38 @@
+import random
+
+import cbot
+
+
+def random_text(rng, words):
+    return " ".join("".join(rng.choice("abcdefghij") for _ in range(6)) for _ in range(words))
+
+
+def test_signature_similarity_tracks_text_overlap():
+    rng = random.Random(5)
+    text = random_text(rng, 30)
+    
+    assert cbot.minhash_signature(text) == cbot.minhash_signature("  " + text.upper())
+    assert cbot.signature_similarity(cbot.minhash_signature(text), cbot.minhash_signature(text + " ok")) > 0.8
+    assert cbot.signature_similarity(cbot.minhash_signature(text), cbot.minhash_signature(random_text(rng, 30))) < 0.3
+    assert len(cbot.minhash_signature("hi")) == cbot.MINHASH_SIZE
+
+
+def test_index_counts_repeats_and_distinct_senders_per_chat():
+    index = cbot.NearDuplicateIndex(window=600, threshold=0.8, chat_size=100, max_chats=10)
+    campaign = "Join our exclusive crypto signals group for guaranteed daily profits"
+    
+    assert index.observe(-1, 1, campaign)["repeats"] == 0
+    assert index.observe(-1, 1, campaign + "!")["repeats"] == 1
+    assert index.observe(-1, 2, campaign)["users"] == 2
+    assert index.observe(-1, 3, "something else entirely, nothing alike")["users"] == 1
+    # Other chats have their own index
+    assert index.observe(-2, 4, campaign) == {"repeats": 0, "users": 1, "similarity": 0.0}
+
+
+def test_index_size_is_bounded_per_chat():
+    rng = random.Random(9)
+    index = cbot.NearDuplicateIndex(window=600, threshold=0.8, chat_size=50, max_chats=10)
+    for user_id in range(200):
+        index.observe(-1, user_id, random_text(rng, 10))
+    
+    assert len(index) <= 51
@@ -0,0 +1,49 @@
+import cbot
+
+
+class Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def message(chat_id, message_id, user_id, text="hi", joined=None):
+    return Obj(
+        id=message_id, chat=Obj(id=chat_id), from_user=Obj(id=user_id), sender_chat=None,
+        text=text, caption=None, media=None, new_chat_members=joined,
+    )
+
+
+def test_per_chat_buffer_evicts_oldest_entries_from_sender_index():
+    recent = cbot.RecentMessages(per_chat=3, max_chats=10)
+    for message_id, user_id in enumerate([1, 2, 1, 1, 2], start=100):
+        recent.record(message(-1, message_id, user_id))
+    
+    assert len(recent) == 3
+    assert [entry[0] for entry in recent.by_sender(-1, 1)] == [103, 102]
+    assert [entry[0] for entry in recent.by_sender(-1, 2)] == [104]
+    assert [entry[0] for entry in recent.by_sender(-1, 1, limit=1)] == [103]
+
+
+def test_time_windows_and_joins(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cbot.time, "time", lambda: now[0])
+    recent = cbot.RecentMessages(per_chat=100, max_chats=10)
+    
+    recent.record(message(-1, 1, 7))
+    now[0] += 3600
+    recent.record(message(-1, 2, 8, joined=[Obj(id=8)]))
+    recent.record_join(-1, 9)
+    recent.record(message(-1, 3, 7))
+    
+    assert [entry[0] for entry in recent.by_sender(-1, 7, seconds=60)] == [3]
+    assert [entry[0] for entry in recent.since(-1, 60)] == [3, 2]
+    assert recent.joined_since(-1, 60) == {8, 9}
+
+
+def test_chat_count_is_capped():
+    recent = cbot.RecentMessages(per_chat=10, max_chats=2)
+    for chat_id in (-1, -2, -3):
+        recent.record(message(chat_id, 1, 5))
+    
+    assert recent.by_sender(-1, 5) == []
+    assert len(recent.by_sender(-3, 5)) == 1
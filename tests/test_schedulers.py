@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+import cbot
+
+
+class MemoryStorage(cbot.StorageBackend):
+    """Storage stub that keeps restrictions and deletions in memory"""
+    
+    def __init__(self, restrictions=(), deletions=()):
+        self.restrictions = list(restrictions)
+        self.deletions = list(deletions)
+    
+    async def add_warning(self, chat_id, user_id, warning):
+        return 0
+    
+    async def get_warnings(self, chat_id, user_id):
+        return []
+    
+    async def pop_warning(self, chat_id, user_id):
+        return False
+    
+    async def save_restriction(self, chat_id, user_id, restriction_type, record):
+        pass
+    
+    async def remove_restriction(self, chat_id, user_id, restriction_type):
+        pass
+    
+    async def load_restrictions(self):
+        return self.restrictions
+    
+    async def save_deletions(self, deletions):
+        self.deletions.extend(deletions)
+    
+    async def remove_deletions(self, deletions):
+        pass
+    
+    async def load_deletions(self):
+        return self.deletions
+
+
+def test_restrictions_pop_in_deadline_order_skipping_stale_entries():
+    scheduler = cbot.RestrictionScheduler(MemoryStorage())
+    scheduler.schedule(1, 10, "ban", datetime.fromtimestamp(300))
+    scheduler.schedule(1, 11, "mute", datetime.fromtimestamp(100))
+    scheduler.schedule(1, 12, "ban", datetime.fromtimestamp(200))
+    # Rescheduled and cancelled restrictions leave stale heap entries behind
+    scheduler.schedule(1, 10, "ban", datetime.fromtimestamp(150))
+    scheduler.cancel(1, 12, "ban")
+    
+    assert [entry[1:] for entry in scheduler._pop_due(120)] == [(1, 11, "mute")]
+    assert [entry[1:] for entry in scheduler._pop_due(1000)] == [(1, 10, "ban")]
+    assert scheduler._pop_due(1000) == []
+    assert len(scheduler) == 0
+
+
+def test_deletion_wheel_fires_each_entry_once_when_due(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cbot.time, "time", lambda: now[0])
+    
+    async def scenario():
+        # Four slots of one second, so the 10s deletion wraps the wheel twice
+        storage = MemoryStorage(deletions=[(-1, 50, 990.0)])
+        scheduler = cbot.DeletionScheduler(storage, None, tick=1.0, slots=4)
+        await scheduler.start()
+        scheduler._task.cancel()
+        
+        scheduler.schedule(-1, 1, 0.5)
+        scheduler.schedule(-2, 2, 2)
+        scheduler.schedule(-1, 3, 10)
+        
+        fired = []
+        for _ in range(12):
+            now[0] += 1
+            for chat_id, ids in scheduler._advance(now[0]).items():
+                fired += [(message_id, now[0]) for message_id in ids]
+        return fired, scheduler
+    
+    fired, scheduler = asyncio.run(scenario())
+    due = {50: 990.0, 1: 1000.5, 2: 1002.0, 3: 1010.0}
+    assert sorted(message_id for message_id, _ in fired) == sorted(due)
+    for message_id, fired_at in fired:
+        # Never early, and at most one tick late (overdue reloads fire on the first tick)
+        assert max(due[message_id], 1000.0) <= fired_at <= max(due[message_id], 1000.0) + 1
+    assert len(scheduler) == 0
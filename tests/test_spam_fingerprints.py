@@ -0,0 +1,32 @@
+import cbot
+
+
+def make_index(**kwargs):
+    return cbot.SpamFingerprintIndex(1000, 3600, min_chats=2, allowlist=("youtube.com",), **kwargs)
+
+
+def test_text_needs_deletions_in_several_chats():
+    index = make_index()
+    spam = "Earn 500 dollars a day, message me now"
+    
+    index.record(spam, -1)
+    index.record(spam, -1)
+    assert index.match(spam) is None
+    
+    index.record(spam, -2)
+    assert index.match(spam.upper()) == "text"
+
+
+def test_mentions_and_emails_are_not_fingerprinted():
+    index = make_index()
+    kinds = [kind for kind, _ in index.fingerprints("write to bob@gmail.com or @someone_else")]
+    assert kinds == ["text"]
+
+
+def test_allowlisted_domains_are_never_fingerprinted_as_a_whole():
+    index = make_index()
+    for chat_id in range(-1, -6, -1):
+        index.record(f"watch https://m.youtube.com/watch?v={chat_id} and https://spam.example/{chat_id}", chat_id)
+    
+    assert index.match("new video https://www.youtube.com/watch?v=other") is None
+    assert index.match("new offer https://spam.example/other") == "domain"
@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+
+import cbot
+
+
+def warning(reason):
+    return {"reason": reason, "warned_by": 1, "timestamp": "2024-01-01T00:00:00"}
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "warnings.json"), str(tmp_path / "warnings.journal")
+
+
+def test_journal_replay_restores_warnings(paths):
+    async def scenario():
+        store = cbot.WarningStore(*paths)
+        store.add(1, 10, warning("a"))
+        store.add(1, 10, warning("b"))
+        store.add(2, 20, warning("c"))
+        store.pop(1, 10)
+        await store.close()
+    
+    asyncio.run(scenario())
+    
+    reloaded = cbot.WarningStore(*paths)
+    assert reloaded.get(1, 10) == [warning("a")]
+    assert reloaded.get(2, 20) == [warning("c")]
+
+
+def test_compaction_folds_journal_into_snapshot(paths, monkeypatch):
+    monkeypatch.setattr(cbot.Config, "WARNINGS_COMPACT_EVERY", 3)
+    
+    async def scenario():
+        store = cbot.WarningStore(*paths)
+        for reason in "abc":
+            store.add(1, 10, warning(reason))
+        await store.close()
+    
+    asyncio.run(scenario())
+    
+    snapshot_file, journal_file = paths
+    with open(journal_file) as f:
+        assert f.read() == ""
+    assert [w["reason"] for w in cbot.WarningStore(*paths).get(1, 10)] == ["a", "b", "c"]
+
+
+def test_replay_skips_entries_already_in_snapshot(paths):
+    snapshot_file, journal_file = paths
+    
+    async def scenario():
+        store = cbot.WarningStore(*paths)
+        store.add(1, 10, warning("a"))
+        store.add(1, 10, warning("b"))
+        store.pop(1, 10)
+        await store.flush()
+        
+        # Crash after the snapshot replace but before the journal truncation
+        with open(journal_file) as f:
+            journal = f.read()
+        store._write_snapshot(store._snapshot())
+        with open(journal_file, "w") as f:
+            f.write(journal)
+        
+        store.add(1, 10, warning("c"))
+        await store.close()
+        return store._seq
+    
+    seq = asyncio.run(scenario())
+    
+    reloaded = cbot.WarningStore(*paths)
+    assert [w["reason"] for w in reloaded.get(1, 10)] == ["a", "c"]
+    assert reloaded._seq == seq
+
+
+def test_replay_applies_legacy_entries_without_sequence(paths):
+    snapshot_file, journal_file = paths
+    with open(snapshot_file, "w") as f:
+        json.dump({"1": {"10": [warning("a")]}}, f)
+    with open(journal_file, "w") as f:
+        f.write(json.dumps({"op": "add", "chat_id": 1, "user_id": 10, "warning": warning("b")}) + "\n")
+        f.write("{torn")
+    
+    assert [w["reason"] for w in cbot.WarningStore(*paths).get(1, 10)] == ["a", "b"]
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_backends_round_trip(backend, tmp_path, monkeypatch):
+    for name in ("USER_WARNINGS_FILE", "WARNINGS_JOURNAL_FILE", "TEMP_BANS_FILE",
+                 "TEMP_MUTES_FILE", "SCHEDULED_DELETIONS_FILE", "SQLITE_DB_FILE"):
+        monkeypatch.setattr(cbot.Config, name, str(tmp_path / name.lower()))
+    
+    async def scenario():
+        storage = cbot.create_storage(backend)
+        await storage.start()
+        assert await storage.add_warning(1, 10, warning("a")) == 1
+        assert await storage.add_warning(1, 10, warning("b")) == 2
+        assert await storage.pop_warning(1, 10)
+        assert await storage.get_warnings(1, 10) == [warning("a")]
+        assert not await storage.pop_warning(2, 20)
+        
+        record = {"until_date": "2030-01-01T00:00:00", "reason": "spam", "timestamp": "2024-01-01T00:00:00"}
+        await storage.save_restriction(1, 10, "ban", record)
+        await storage.save_restriction(1, 11, "mute", record)
+        await storage.remove_restrictions([(1, 11, "mute")])
+        restrictions = await storage.load_restrictions()
+        
+        await storage.save_deletions([(1, 100, 5.0), (1, 101, 6.0)])
+        await storage.remove_deletions([(1, 100)])
+        deletions = await storage.load_deletions()
+        await storage.close()
+        return restrictions, deletions
+    
+    restrictions, deletions = asyncio.run(scenario())
+    assert [tuple(row[:3]) for row in restrictions] == [(1, 10, "ban")]
+    assert [tuple(row) for row in deletions] == [(1, 101, 6.0)]
+
+
+def test_incomplete_backend_fails_on_instantiation():
+    class PartialStorage(cbot.StorageBackend):
+        async def add_warning(self, chat_id, user_id, warning):
+            return 1
+    
+    with pytest.raises(TypeError):
+        PartialStorage()
@@ -0,0 +1,31 @@
+import pytest
+
+import cbot
+
+
+@pytest.mark.parametrize("text, links, mentions, link_spam_count", [
+    ("thanks @alice @bob @carol", 0, 3, 0),
+    ("mail me at me@gmail.com", 0, 1, 0),
+    ("join t.me/channel with @alice and @bob", 1, 2, 3),
+    ("HTTPS://a.io http://b.io WWW.c.io", 3, 0, 3),
+    # A bare "http" still makes mentions count, as the original substring check did
+    ("http @a @b @c", 0, 3, 3),
+    ("see www @a", 0, 1, 0),
+    ("plain text", 0, 0, 0),
+])
+def test_link_and_mention_counts(text, links, mentions, link_spam_count):
+    features = cbot.TextFeatures(text)
+    assert features.link_count == links
+    assert features.mention_count == mentions
+    assert features.link_spam_count == link_spam_count
+
+
+def test_rule_verdicts_are_cached_per_exact_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(cbot.Config, "BANNED_WORDS_FILE", str(tmp_path / "banned_words.txt"))
+    content_filter = cbot.ContentFilter()
+    
+    shouting = content_filter.evaluate("ABCDEFGHIJKL", -1)
+    padded = content_filter.evaluate("ABCDEFGHIJKL" + " " * 20, -1)
+    assert "excessive_caps" in shouting["spam"]["reasons"]
+    assert "excessive_caps" not in padded["spam"]["reasons"]
+    assert content_filter.evaluate("ABCDEFGHIJKL", -1) is shouting